@@ -1,67 +1,244 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from functools import lru_cache
+import json
+import math
+import mmap
+import multiprocessing
 import os
 import sys
 import shutil
+import struct
 import requests
 from pathlib import Path
 from tqdm import tqdm
 import time
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 VERSION = "1.0"
 KEY = "tdmcliKeyy"
+KEY_BYTES = KEY.encode()
+KEY_PERIOD = math.lcm(len(KEY_BYTES), 64)
+XOR_CHUNK = -(-65536 // KEY_PERIOD) * KEY_PERIOD
+READ_BLOCK = 1 << 20
 MAX_WORKERS = os.cpu_count() * 4
-
+XorExecutor = ThreadPoolExecutor if np is not None else ProcessPoolExecutor
+XOR_WORKERS = MAX_WORKERS if np is not None else os.cpu_count()
+TEMPLATE_BUFFER = 4 << 20
+END_OF_FILE = b"\nEND_OF_FILE\n"
+TEMPLATE_MAGIC = b"TDMCLI2\0"
+PATH_LENGTH = struct.Struct("<H")
+PAYLOAD_SIZE = struct.Struct("<Q")
+VERSION_CACHE_TTL = 3600
+
+@lru_cache(maxsize=1)
 def get_templates_dir():
     templates_dir = os.getenv("TDMCLI_TEMPLATE_DIR", os.path.join(os.getenv("APPDATA"), "tdmcli", "templates"))
     if not os.path.exists(templates_dir):
         os.makedirs(templates_dir, exist_ok=True)
     return templates_dir
 
-def xor_crypt(data, key):
-    key_bytes = key.encode()
-    key_len = len(key_bytes)
-    return bytearray([b ^ key_bytes[i % key_len] for i, b in enumerate(data)])
-
-def process_file(file_path, root_dir):
-    relative_path = os.path.relpath(file_path, root_dir)
+@lru_cache(maxsize=1)
+def get_templates_root():
+    return Path(get_templates_dir())
+
+def get_template_path(template_name):
+    return get_templates_root() / f"{template_name}.tdmcli"
+
+@lru_cache(maxsize=None)
+def tiled_key(phase):
+    tiled = (KEY_BYTES[phase:] + KEY_BYTES[:phase]) * (XOR_CHUNK // len(KEY_BYTES))
+    return tiled, int.from_bytes(tiled, 'little'), np.frombuffer(tiled, dtype=np.uint8) if np is not None else None
+
+def xor_crypt(data, output=None, key_offset=0):
+    if output is None:
+        output = bytearray(len(data))
+    key_bytes, key_int, key_array = tiled_key(key_offset % len(KEY_BYTES))
+
+    if np is not None:
+        data_array = np.frombuffer(data, dtype=np.uint8)
+        output_array = np.frombuffer(output, dtype=np.uint8)
+        for offset in range(0, data_array.size, XOR_CHUNK):
+            chunk = data_array[offset:offset + XOR_CHUNK]
+            np.bitwise_xor(chunk, key_array[:chunk.size], out=output_array[offset:offset + chunk.size])
+        return output
+
+    for offset in range(0, len(data), XOR_CHUNK):
+        chunk = data[offset:offset + XOR_CHUNK]
+        chunk_len = len(chunk)
+        chunk_key = key_int if chunk_len == XOR_CHUNK else int.from_bytes(key_bytes[:chunk_len], 'little')
+        output[offset:offset + chunk_len] = (int.from_bytes(chunk, 'little') ^ chunk_key).to_bytes(chunk_len, 'little')
+    return output
+
+def process_block(file_path, offset, length):
     with open(file_path, 'rb') as input_file:
-        content = input_file.read()
-    encrypted_content = xor_crypt(content, KEY)
-    return relative_path, encrypted_content
+        length = min(length, os.fstat(input_file.fileno()).st_size - offset)
+        if length <= 0:
+            return b""
+        with mmap.mmap(input_file.fileno(), length, access=mmap.ACCESS_READ, offset=offset) as input_map:
+            return xor_crypt(input_map, key_offset=offset)
+
+def bounded_map(executor, fn, tasks, window):
+    pending = deque()
+    for task in tasks:
+        pending.append(executor.submit(fn, *task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def walk_rel(root_dir):
+    stack = [(root_dir, "")]
+    while stack:
+        base_dir, relative_dir = stack.pop()
+        try:
+            with os.scandir(base_dir) as scanner:
+                dir_entries = sorted(scanner, key=lambda entry: entry.name)
+        except OSError:
+            continue
+
+        subdirs = []
+        for entry in dir_entries:
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    subdirs.append((entry.path, relative_dir + entry.name + os.sep))
+            else:
+                yield entry.path, relative_dir + entry.name, entry.stat()
+        stack.extend(reversed(subdirs))
+
+def load_template_cache(template_path):
+    try:
+        with open(f"{template_path}.cache") as cache_file:
+            cache = json.load(cache_file)
+        template_stat = os.stat(template_path)
+    except (OSError, ValueError):
+        return {}
+    if cache.get("template") != [template_stat.st_mtime_ns, template_stat.st_size]:
+        return {}
+    return cache["files"]
+
+def save_template_cache(template_path, cached_files):
+    template_stat = os.stat(template_path)
+    with open(f"{template_path}.cache", 'w') as cache_file:
+        json.dump({"template": [template_stat.st_mtime_ns, template_stat.st_size], "files": cached_files}, cache_file)
+
+def copy_template_payload(source, target, offset, size):
+    source.seek(offset)
+    while size > 0:
+        block = source.read(min(size, READ_BLOCK))
+        target.write(block)
+        size -= len(block)
 
 def create_template(template_name, root_dir='.'):
     print(f"Loading... Creating template '{template_name}'.")
-    time.sleep(0.5)
-
-    template_path = os.path.join(get_templates_dir(), f"{template_name}.tdmcli")
-    all_files = [os.path.join(root, file) for root, _, files in os.walk(root_dir) for file in files]
-
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = [executor.submit(process_file, file_path, root_dir) for file_path in all_files]
-        
-        with open(template_path, 'wb') as template_file:
-            for future in tqdm(as_completed(futures), total=len(futures), desc="Creating Template"):
-                relative_path, encrypted_content = future.result()
-                template_file.write(f"FILE: {relative_path}\n".encode())
-                template_file.write(f"SIZE: {len(encrypted_content)}\n".encode())
-                template_file.write(encrypted_content)
-                template_file.write(b"\nEND_OF_FILE\n")
-    
-    print(f"Template '{template_name}' created successfully.")
 
-def process_template_file(lines, start_index):
-    file_name = lines[start_index][6:].strip().decode()
-    size = int(lines[start_index + 1][6:].strip())
-    encrypted_content = b''.join(lines[start_index + 2:])
-    decrypted_content = xor_crypt(encrypted_content[:size], KEY)
+    template_path = get_template_path(template_name)
+    previous_files = load_template_cache(template_path)
+    all_files = []
+    reused_offsets = {}
+    for file_path, relative_path, file_stat in walk_rel(root_dir):
+        cache_key = os.path.abspath(file_path)
+        signature = [file_stat.st_mtime_ns, file_stat.st_size]
+        previous = previous_files.get(cache_key)
+        if previous and previous[:2] == signature:
+            reused_offsets[cache_key] = previous[2]
+        all_files.append((file_path, relative_path, cache_key, signature))
+
+    cached_files = {}
+    temp_path = f"{template_path}.tmp"
+    block_tasks = ((file_path, block_offset, min(READ_BLOCK, size - block_offset))
+                   for file_path, _, cache_key, (_, size) in all_files if cache_key not in reused_offsets
+                   for block_offset in range(0, size, READ_BLOCK))
+    try:
+        with XorExecutor(max_workers=XOR_WORKERS) as executor, open(temp_path, 'wb', buffering=TEMPLATE_BUFFER) as template_file, \
+                (open(template_path, 'rb') if reused_offsets else nullcontext()) as previous_template:
+            template_file.write(TEMPLATE_MAGIC)
+            results = bounded_map(executor, process_block, block_tasks, 2 * XOR_WORKERS)
+            for _, relative_path, cache_key, signature in tqdm(all_files, desc="Creating Template"):
+                encoded_path = relative_path.encode()
+                size = signature[1]
+                template_file.write(PATH_LENGTH.pack(len(encoded_path)) + encoded_path + PAYLOAD_SIZE.pack(size))
+                offset = template_file.tell()
+                if cache_key in reused_offsets:
+                    copy_template_payload(previous_template, template_file, reused_offsets[cache_key], size)
+                else:
+                    for _ in range(0, size, READ_BLOCK):
+                        template_file.write(next(results))
+                    read_size = template_file.tell() - offset
+                    if read_size != size:
+                        template_file.seek(offset - PAYLOAD_SIZE.size)
+                        template_file.write(PAYLOAD_SIZE.pack(read_size))
+                        template_file.seek(offset + read_size)
+                        continue
+                cached_files[cache_key] = signature + [offset]
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    os.replace(temp_path, template_path)
+    save_template_cache(template_path, cached_files)
+    print(f"Template '{template_name}' created successfully.")
 
-    file_dir = os.path.dirname(file_name)
-    if file_dir and not os.path.exists(file_dir):
-        os.makedirs(file_dir, exist_ok=True)
+def read_template_entries(template_map):
+    if template_map[:len(TEMPLATE_MAGIC)] == TEMPLATE_MAGIC:
+        return read_template_records(template_map)
+    return read_legacy_template_entries(template_map)
+
+def read_template_records(template_map):
+    entries = []
+    position = len(TEMPLATE_MAGIC)
+    while position < len(template_map):
+        if position + PATH_LENGTH.size > len(template_map):
+            raise ValueError("truncated record header")
+        (path_length,) = PATH_LENGTH.unpack_from(template_map, position)
+        position += PATH_LENGTH.size
+        if position + path_length + PAYLOAD_SIZE.size > len(template_map):
+            raise ValueError("truncated record header")
+        file_name = template_map[position:position + path_length].decode()
+        position += path_length
+        (size,) = PAYLOAD_SIZE.unpack_from(template_map, position)
+        position += PAYLOAD_SIZE.size
+        if position + size > len(template_map):
+            raise ValueError(f"truncated payload for '{file_name}'")
+        entries.append((file_name, position, size))
+        position += size
+    return entries
+
+def read_legacy_template_entries(template_map):
+    entries = []
+    position = 0
+    while template_map[position:position + 6] == b"FILE: ":
+        name_end = template_map.find(b"\n", position)
+        size_end = template_map.find(b"\n", name_end + 1) if name_end != -1 else -1
+        if size_end == -1:
+            raise ValueError("truncated entry header")
+        file_name = template_map[position + 6:name_end].strip().decode()
+        size = int(template_map[name_end + 7:size_end].strip())
+        payload_end = size_end + 1 + size
+        if payload_end > len(template_map):
+            raise ValueError(f"truncated payload for '{file_name}'")
+        if template_map[payload_end:payload_end + len(END_OF_FILE)] != END_OF_FILE:
+            raise ValueError(f"missing end marker for '{file_name}'")
+        entries.append((file_name, size_end + 1, size))
+        position = payload_end + len(END_OF_FILE)
+    if position != len(template_map):
+        raise ValueError("unrecognized data after last entry")
+    return entries
+
+def extract_template_entry(template_map, file_name, offset, size):
+    with open(file_name, 'w+b') as output_file:
+        if size == 0:
+            return
+        output_file.truncate(size)
+        with mmap.mmap(output_file.fileno(), size) as output_map, memoryview(template_map)[offset:offset + size] as encrypted_content:
+            xor_crypt(encrypted_content, output_map)
 
-    with open(file_name, 'wb') as output_file:
-        output_file.write(decrypted_content)
-        
 def change_templates_dir(new_dir):
     if not os.path.exists(new_dir):
         os.makedirs(new_dir, exist_ok=True)
@@ -84,50 +261,54 @@ def change_templates_dir(new_dir):
         print("Templates were not transferred.")
 
     os.environ["TDMCLI_TEMPLATE_DIR"] = new_dir
+    get_templates_dir.cache_clear()
+    get_templates_root.cache_clear()
 
     print(f"Templates directory updated to: {new_dir}")
 
 
 def apply_template(template_name):
     print(f"Loading... Applying template '{template_name}'.")
-    time.sleep(0.5)
 
-    template_path = os.path.join(get_templates_dir(), f"{template_name}.tdmcli")
+    template_path = get_template_path(template_name)
     if not os.path.exists(template_path):
         print(f"Template '{template_name}' not found.")
         return
 
-    with open(template_path, 'rb') as template_file:
-        lines = template_file.readlines()
-
-    futures = []
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        total_files = sum(1 for line in lines if line.startswith(b"FILE: "))
-        i = 0
-        with tqdm(total=total_files, desc="Applying Template") as pbar:
-            while i < len(lines):
-                if lines[i].startswith(b"FILE: "):
-                    futures.append(executor.submit(process_template_file, lines, i))
-                    i += 3
-                    pbar.update(1)
-                else:
-                    i += 1
+    if os.path.getsize(template_path) == 0:
+        print(f"Template '{template_name}' applied successfully.")
+        return
+
+    with open(template_path, 'rb') as template_file, mmap.mmap(template_file.fileno(), 0, access=mmap.ACCESS_READ) as template_map:
+        try:
+            entries = read_template_entries(template_map)
+        except ValueError as error:
+            print(f"Template '{template_name}' is corrupt or truncated: {error}.")
+            return
 
-        for future in as_completed(futures):
-            future.result()
+        for file_dir in sorted({os.path.dirname(file_name) for file_name, _, _ in entries} - {""}):
+            os.makedirs(file_dir, exist_ok=True)
+
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = [executor.submit(extract_template_entry, template_map, *entry) for entry in entries]
+
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Applying Template"):
+                future.result()
 
     print(f"Template '{template_name}' applied successfully.")
 
 def delete_template(template_name):
-    template_path = os.path.join(get_templates_dir(), f"{template_name}.tdmcli")
+    template_path = get_template_path(template_name)
     if os.path.exists(template_path):
         os.remove(template_path)
+        if os.path.exists(f"{template_path}.cache"):
+            os.remove(f"{template_path}.cache")
         print(f"Template '{template_name}' deleted.")
     else:
         print(f"Template '{template_name}' not found.")
 
 def list_templates():
-    templates = [f.stem for f in Path(get_templates_dir()).glob("*.tdmcli")]
+    templates = [f.stem for f in get_templates_root().glob("*.tdmcli")]
     if templates:
         print("Your templates:\n\n")
         for t in templates:
@@ -139,12 +320,32 @@ def actual_version():
     print(f"Version of tdmcli: {VERSION}")
 
 def get_latest_release_version():
+    app_data = os.getenv("APPDATA")
+    version_cache = os.path.join(app_data, "tdmcli", "version") if app_data else None
+    if version_cache:
+        try:
+            if time.time() - os.path.getmtime(version_cache) < VERSION_CACHE_TTL:
+                with open(version_cache) as cache_file:
+                    return cache_file.read().strip()
+        except OSError:
+            pass
+
     try:
-        response = requests.get("https://raw.githubusercontent.com/MrTigerST/tdmcli/main/version")
-        return response.text.strip()
+        response = requests.get("https://raw.githubusercontent.com/MrTigerST/tdmcli/main/version", timeout=3)
+        response.raise_for_status()
+        latest_version = response.text.strip()
     except requests.RequestException:
         return None
 
+    if version_cache:
+        try:
+            os.makedirs(os.path.dirname(version_cache), exist_ok=True)
+            with open(version_cache, 'w') as cache_file:
+                cache_file.write(latest_version)
+        except OSError:
+            pass
+    return latest_version
+
 def check_for_updates():
     latest_version = get_latest_release_version()
     if latest_version:
@@ -158,7 +359,7 @@ def check_for_updates():
         print("Failed to check for updates.")
 
 def export_template(template_name, output_dir):
-    template_path = os.path.join(get_templates_dir(), f"{template_name}.tdmcli")
+    template_path = get_template_path(template_name)
     if os.path.exists(template_path):
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
@@ -170,7 +371,7 @@ def export_template(template_name, output_dir):
 def import_template(input_file, template_name=None):
     if not template_name:
         template_name = Path(input_file).stem
-    dest_path = os.path.join(get_templates_dir(), f"{template_name}.tdmcli")
+    dest_path = get_template_path(template_name)
     shutil.copy(input_file, dest_path)
     print(f"Template imported from '{input_file}' as '{template_name}'")
 
@@ -226,5 +427,6 @@ def main():
         show_help_command()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
 